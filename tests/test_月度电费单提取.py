@@ -0,0 +1,108 @@
+from io import BytesIO
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import Workbook
+
+SOURCE = Path(__file__).resolve().parent.parent / "月度电费单提取.py"
+UI_MARKER = "# -------------------------- Streamlit 界面配置"
+
+
+def load_helpers():
+    """只执行界面配置之前的部分（常量与提取函数），不启动Streamlit页面"""
+    source = SOURCE.read_text(encoding="utf-8")
+    namespace = {}
+    exec(compile(source[:source.index(UI_MARKER)], str(SOURCE), "exec"), namespace)
+    return namespace
+
+
+def clean_data(val):
+    """逐单元格清洗的原实现，作为 clean_numeric 的对照"""
+    if pd.isna(val):
+        return 0.0
+    if isinstance(val, str):
+        cleaned = val.strip().replace(',', '').replace(' ', '')
+        if cleaned in ['/', '无', 'None', '']:
+            return 0.0
+        try:
+            return float(cleaned)
+        except:
+            return 0.0
+    return float(val)
+
+
+def test_clean_numeric_matches_clean_data():
+    clean_numeric = load_helpers()["clean_numeric"]
+    values = [
+        "１２３", "１,２３４.５", "1234.5\xa0", "　3.5", " 1,000 ", "-12.5",
+        True, False, "/", "无", "None", "", "abc", None, 2.5, 7,
+    ]
+
+    result = clean_numeric(pd.Series(values, dtype=object))
+
+    assert result.tolist() == [clean_data(val) for val in values]
+
+
+def build_settlement(rows):
+    """生成结算文件：前4行为表头说明，第5行为列名，其后为科目行"""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "sheet1"
+    for _ in range(4):
+        ws.append(["结算单"])
+    ws.append(["序号", "科目名称", "单位", "电量", "电价", "备注", "金额", "实际上网电量"])
+    for row in rows:
+        ws.append(row)
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def test_extract_plant_known_values():
+    extract_plant = load_helpers()["extract_plant"]
+    rows = [
+        [1, "合计", "", 5000, "", "", 1000000, 5000],
+        [2, "省间调峰购入分摊退补", "", "", "", "", 1200.5, None],
+        [3, "省内调频辅助服务退补", "", "", "", "", -300.25, None],
+        [4, "两个细则补偿费用清算", "", "", "", "", 500, None],
+        # 配储科目名中含“两个细则补偿费用退补”，同时计入普通两个细则与配储两个细则
+        [5, "配建储能两个细则补偿费用退补", "", "", "", "", 250, None],
+        [6, "中长期超额获利回收电费（现货）", "", "", "", "", 111.11, None],
+        [7, "中长期超额获利回收电费（现货）", "", "", "", "", 222.22, None],
+        [8, "省内现货交易", "", 1234, "", "", 56789, None],
+        [9, "省间现货交易", "", 10, "", "", 20000, None],
+        [10, "中长期交易", "", "", "", "", 300000, None],
+        [11, "机制电量差价结算费用", "", 2652.6, "", "", 1000, None],
+        [12, "基础电量", "", 2000, "", "", "", None],
+        [13, "机制电量差价结算费用退补", "", 2026.95, "", "", -200, None],
+    ]
+    rows += [[pos, "其他", "", "", "", "", 0, None] for pos in range(len(rows), 168)]
+    rows += [[168, "偏差考核", "", "", "", "", 5000, None], [169, "其他", "", "", "", "", 0, None]]
+    template_row = pd.Series({
+        "上网电量（万千瓦时）": 0.0,
+        "基础电量/优先发电量（万千瓦时）": 0.0,
+        "交易电量占比（%）": 0.0,
+        "结算电费（万元）": 0.0,
+    })
+
+    plant_out, log, messages, error = extract_plant(build_settlement(rows), "电厂A.xlsx", template_row)
+
+    assert error is None
+    assert plant_out["辅助服务（元）"] == 900.25
+    assert plant_out["两个细则（元）"] == 750.0
+    assert plant_out["配储两个细则（元）"] == 250.0
+    assert plant_out["中长期超额获利回收电费（元）"] == 222.22
+    assert plant_out["省内现货电费（万元）"] == 5.68
+    assert plant_out["省内现货偏差电量（万千瓦时）"] == 123.4
+    assert plant_out["省间现货电费（万元）"] == 2.0
+    assert plant_out["省间现货电量（万千瓦时）"] == 1.0
+    assert plant_out["中长期电费（万元）"] == 30.0
+    assert plant_out["保障性电费（万元）"] == 0.0
+    # 逐行折算后累加：265.26 + 202.695 = 467.955 → 467.95（先合计再折算会得到467.96）
+    assert plant_out["机制电量（万kwh）"] == 467.95
+    assert plant_out["机制电费（元）"] == 800.0
+    assert plant_out["上网电量（万千瓦时）"] == 500.0
+    assert plant_out["基础电量/优先发电量（万千瓦时）"] == 200.0
+    assert plant_out["考核金额"] == 0.5
+    assert plant_out["是否有偏差考核"] == "是"
+    assert plant_out["结算电费（万元）"] == 100.0
@@ -1,8 +1,26 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
+import re
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import BytesIO
+from openpyxl import Workbook
+
+# calamine 引擎需要 pandas >= 2.2 且已安装 python-calamine，不满足时改用其他引擎（其余读取错误照常抛出）
+try:
+    import python_calamine  # noqa: F401
+    CALAMINE_AVAILABLE = tuple(int(part) for part in pd.__version__.split('.')[:2]) >= (2, 2)
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
+# 文本列优先使用Arrow存储的字符串类型（未安装pyarrow时退回普通字符串类型）
+try:
+    import pyarrow  # noqa: F401
+    TEXT_DTYPE = pd.StringDtype("pyarrow")
+except ImportError:
+    TEXT_DTYPE = pd.StringDtype()
 
 # -------------------------- 基础配置（保留映射表） --------------------------
 plant_name_mapping = {
@@ -58,6 +76,25 @@ NEW_TARGETS = {
 TARGET_MECHANISM = ["机制电量差价结算费用", "机制电量差价结算费用退补"]
 MECHANISM_POWER_COL_INDEX = 3
 amount_col_index = 6
+# .xls（OLE2复合文档）文件头，calamine不可用时据此选择xlrd回退
+XLS_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+# 全部目标科目→(科目组, 附加信息)分派表：列表科目附加明细标签，新增科目附加自身名称（对应NEW_TARGETS配置）
+SUBJECT_TABLE = {}
+SUBJECT_TABLE.update({sub: ('aux', '辅助服务') for sub in TARGET_AUX_SERVICES})
+SUBJECT_TABLE.update({sub: ('two', '普通两个细则') for sub in TARGET_TWO_RULES})
+SUBJECT_TABLE.update({sub: ('storage', '配储两个细则') for sub in TARGET_STORAGE_TWO_RULES})
+SUBJECT_TABLE.update({sub: ('mech', None) for sub in TARGET_MECHANISM})
+SUBJECT_TABLE[TARGET_PROFIT_RECOVERY] = ('profit', None)
+SUBJECT_TABLE.update({sub: ('new', sub) for sub in NEW_TARGETS})
+# 单个正则一次扫描全部科目：零宽前瞻逐位置取最长科目，可报告重叠命中（“配建储能两个细则…”内含的普通两个细则科目同样计入）
+SUBJECT_SCAN_RE = re.compile('(?=(' + '|'.join(map(re.escape, sorted(SUBJECT_TABLE, key=len, reverse=True))) + '))')
+# 按金额（机制组另含电量）累加的科目组，对应掩码矩阵的列顺序
+SUM_GROUPS = ['aux', 'two', 'storage', 'mech']
+# 机制电量及新增科目用到的电量列位置
+POWER_COL_INDEXES = {MECHANISM_POWER_COL_INDEX} | {
+    mapping["power_col_index"] for mapping in NEW_TARGETS.values() if mapping["power_col_index"] is not None
+}
 
 # 必需列定义
 required_columns = [
@@ -77,20 +114,273 @@ required_columns = [
     '配储两个细则（元）',
     '配储两个细则电费（万元）'
 ]
+# 金额/电量类列名关键字（补全时按float64创建）
+NUMERIC_COL_KEYS = ['（元）', '（万元）', '（%）', '万千瓦时', '万kwh']
+# 纯文本列（使用字符串类型存储）
+TEXT_COLUMNS = ['电厂名称', '是否有偏差考核']
+
+# -------------------------- 工具函数 --------------------------
+def clean_numeric(series):
+    """整列清洗为数值：全角字符转半角，去除千分位与首尾空白，布尔值按1/0计，'/'、'无'、'None'及无法解析的值记为0"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.fillna(0.0).astype(float)
+    cleaned = series.astype(str).str.normalize('NFKC').str.strip()
+    cleaned = cleaned.str.replace(',', '', regex=False).str.replace(' ', '', regex=False)
+    cleaned = cleaned.replace({'/': '', '无': '', 'None': ''})
+    numeric = pd.to_numeric(cleaned, errors='coerce').fillna(0.0)
+    # 布尔单元格按1/0计（isin同时命中数值0/1，其取值不变）
+    return numeric.mask(series.isin([True, False]), series.eq(True).astype(float))
+
+def build_subject_text(target_df):
+    """将金额列之前的科目文本列拼接成一列，供整列匹配科目"""
+    # 纯数值列不可能含科目名称，只对文本列做字符串转换与拼接
+    text_cols = [
+        target_df.iloc[:, col_pos] for col_pos in range(min(amount_col_index, len(target_df.columns)))
+        if not pd.api.types.is_numeric_dtype(target_df.iloc[:, col_pos])
+    ]
+    if not text_cols:
+        return pd.Series('', index=target_df.index)
+    subject_text = text_cols[0].fillna('').astype(str)
+    for text_col in text_cols[1:]:
+        subject_text = subject_text + ' ' + text_col.fillna('').astype(str)
+    return subject_text
 
-# -------------------------- 工具函数（完整保留） --------------------------
-def clean_data(val):
-    if pd.isna(val):
-        return 0.0
-    if isinstance(val, str):
-        cleaned = val.strip().replace(',', '').replace(' ', '')
-        if cleaned in ['/', '无', 'None', '']:
-            return 0.0
-        try:
-            return float(cleaned)
-        except:
-            return 0.0
-    return float(val)
+def scan_subjects(subject_text):
+    """一次扫描全部目标科目，按行顺序返回命中列表 [(行位置, 科目组, 附加信息, 科目名)]，同一行同组只计一次"""
+    hits = []
+    for row_pos, matched_subjects in enumerate(subject_text.str.findall(SUBJECT_SCAN_RE)):
+        matched_keys = set()
+        for subject in matched_subjects:
+            group, meta = SUBJECT_TABLE[subject]
+            if (group, meta) not in matched_keys:
+                matched_keys.add((group, meta))
+                hits.append((row_pos, group, meta, subject))
+    return hits
+
+def column_values(target_df, col_index):
+    """按列位置整列清洗为数值数组，列不存在时返回全0"""
+    if len(target_df.columns) <= col_index:
+        return np.zeros(len(target_df))
+    return clean_numeric(target_df.iloc[:, col_index]).to_numpy(dtype=float)
+
+def read_excel_fast(file, **kwargs):
+    """calamine引擎可用时用其读取Excel（xlsx/xls通用），否则按文件格式改用openpyxl（xlsx）或xlrd（xls）"""
+    if CALAMINE_AVAILABLE:
+        return pd.read_excel(file, engine='calamine', **kwargs)
+    file.seek(0)
+    fallback_engine = 'xlrd' if file.read(len(XLS_SIGNATURE)) == XLS_SIGNATURE else 'openpyxl'
+    file.seek(0)
+    return pd.read_excel(file, engine=fallback_engine, **kwargs)
+
+def read_settlement_file(file):
+    """读取结算文件sheet1，只保留科目文本/电量/金额列（0~金额列）及“实际上网电量”列"""
+    # 整表只解析一次，再按列位置裁剪（calamine无论usecols如何都会解析整张sheet）
+    target_df = read_excel_fast(file, sheet_name='sheet1', header=4)
+    keep = list(range(min(amount_col_index + 1, len(target_df.columns))))
+    keep += [col_pos for col_pos, col_name in enumerate(target_df.columns)
+             if col_name == '实际上网电量' and col_pos > amount_col_index][:1]
+    return target_df.iloc[:, keep]
+
+def extract_plant(settlement_bytes, file_name, template_row):
+    """提取单个电厂结算文件的各项指标（不调用Streamlit，可在线程池中并行执行）
+
+    返回 (提取结果, 明细日志, 提示信息列表, 失败原因)，提取结果为已写入的部分字段
+    """
+    plant_out = {}
+    log = []
+    messages = []
+    try:
+        # 读取结算文件（每个任务持有独立的内存副本）
+        target_df = read_settlement_file(BytesIO(settlement_bytes))
+        messages.append(("success", f"✅ 成功读取结算文件：{file_name}（数据形状：{target_df.shape}）"))
+        
+        # 初始化提取变量
+        new_target_results = {
+            "省内现货偏差电量（万千瓦时）": 0.0,
+            "省内现货电费（万元）": 0.0,
+            "省间现货电量（万千瓦时）": 0.0,
+            "省间现货电费（万元）": 0.0,
+            "中长期电费（万元）": 0.0,
+            "保障性电费（万元）": 0.0
+        }
+        
+        # 科目文本与金额/电量列各只清洗一次
+        subject_text = build_subject_text(target_df)
+        has_amount_col = len(target_df.columns) > amount_col_index
+        amount_values = column_values(target_df, amount_col_index)
+        power_values = {col: column_values(target_df, col) for col in POWER_COL_INDEXES if len(target_df.columns) > col}
+        hits = scan_subjects(subject_text)
+        
+        # 累加类科目组：由扫描结果构建 行×组 掩码矩阵，金额与机制电量各一次矩阵乘法得到全部合计
+        group_masks = np.zeros((len(target_df), len(SUM_GROUPS)))
+        profit_rows = []
+        for row_pos, group, meta, subject in hits:
+            if group in SUM_GROUPS:
+                group_masks[row_pos, SUM_GROUPS.index(group)] = 1.0
+            elif group == 'profit':
+                profit_rows.append(row_pos)
+        group_sums = dict(zip(SUM_GROUPS, (amount_values @ group_masks).tolist()))
+        
+        # 1-3. 辅助服务 / 普通两个细则 / 配储两个细则：金额合计
+        aux_service_sum = group_sums['aux'] if has_amount_col else 0.0
+        two_rules_sum = group_sums['two'] if has_amount_col else 0.0
+        storage_two_rules_sum = group_sums['storage'] if has_amount_col else 0.0
+        # 4. 超额获利回收（多行命中时取最后一行）
+        profit_recovery = float(amount_values[profit_rows[-1]]) if has_amount_col and profit_rows else 0.0
+        # 6. 机制电量相关：电量、电费合计
+        mech_mask = group_masks[:, SUM_GROUPS.index('mech')]
+        mechanism_power_sum = 0.0
+        if MECHANISM_POWER_COL_INDEX in power_values:
+            # 逐行折算为万kwh后再累加，与逐行提取的合计保持一致
+            mechanism_power_sum = float((power_values[MECHANISM_POWER_COL_INDEX] / 10) @ mech_mask)
+        mechanism_fee_sum = group_sums['mech'] if has_amount_col else 0.0
+        
+        # 明细日志按行顺序逐条命中输出；新增科目（多行命中时取最后一行）在此赋值
+        def log_group_amount(row_pos, group, subject, label):
+            if has_amount_col:
+                log.append(f"  ✅ {label}：{subject} → {amount_values[row_pos]:.2f}元")
+        
+        def log_profit_recovery(row_pos, group, subject, meta):
+            if has_amount_col:
+                log.append(f"  ✅ 超额获利回收：{subject} → {amount_values[row_pos]:.2f}元")
+        
+        def set_new_target(row_pos, group, subject, target_subject):
+            mapping = NEW_TARGETS[target_subject]
+            log.append(f"  🔍 匹配新增科目：{target_subject}")
+            # 提取电费
+            if has_amount_col:
+                fee = float(amount_values[row_pos]) / 10000
+                new_target_results[mapping["fee_field"]] = round(fee, 2)
+                log.append(f"    ✅ 电费：{fee:.2f}万元")
+            # 提取电量
+            if mapping["power_field"] and mapping["power_col_index"] in power_values:
+                power = float(power_values[mapping["power_col_index"]][row_pos]) / 10
+                new_target_results[mapping["power_field"]] = round(power, 2)
+                log.append(f"    ✅ 电量：{power:.2f}万千瓦时")
+        
+        def log_mechanism(row_pos, group, subject, meta):
+            log.append(f"  🔍 匹配机制科目：{subject}")
+            if MECHANISM_POWER_COL_INDEX in power_values:
+                log.append(f"    ✅ 机制电量：{power_values[MECHANISM_POWER_COL_INDEX][row_pos] / 10:.2f}万kwh")
+            if has_amount_col:
+                log.append(f"    ✅ 机制电费：{amount_values[row_pos]:.2f}元")
+        
+        dispatch = {
+            "aux": log_group_amount,
+            "two": log_group_amount,
+            "storage": log_group_amount,
+            "profit": log_profit_recovery,
+            "new": set_new_target,
+            "mech": log_mechanism
+        }
+        for row_pos, group, meta, subject in hits:
+            dispatch[group](row_pos, group, subject, meta)
+        
+        # 赋值到本电厂结果缓存
+        plant_out['辅助服务（元）'] = round(aux_service_sum, 2)
+        plant_out['辅助服务电费(万元)'] = round(aux_service_sum / 10000, 4)
+        plant_out['两个细则（元）'] = round(two_rules_sum, 2)
+        plant_out['两个细则电费（万元）'] = round(two_rules_sum / 10000, 4)
+        plant_out['配储两个细则（元）'] = round(storage_two_rules_sum, 2)
+        plant_out['配储两个细则电费（万元）'] = round(storage_two_rules_sum / 10000, 4)
+        plant_out['中长期超额获利回收电费（元）'] = round(profit_recovery, 2)
+        
+        # 新增字段赋值
+        plant_out.update(new_target_results)
+        
+        # 机制字段赋值
+        plant_out['机制电量（万kwh）'] = round(mechanism_power_sum, 2)
+        plant_out['机制电费（元）'] = round(mechanism_fee_sum, 2)
+        
+        # 其他指标提取
+        # 上网电量
+        if '实际上网电量' in target_df.columns and len(target_df) > 0:
+            try:
+                actual_power = float(clean_numeric(target_df['实际上网电量'].iloc[:1]).iloc[0]) / 10
+                plant_out['上网电量（万千瓦时）'] = round(actual_power, 2)
+                log.append(f"📊 上网电量：{actual_power:.2f}万千瓦时")
+            except:
+                messages.append(("warning", "⚠️ 上网电量提取失败"))
+        
+        # 基础电量
+        base_power_row = 11
+        base_power_col = 3
+        if len(target_df) > base_power_row and len(target_df.columns) > base_power_col:
+            try:
+                base_power = float(clean_numeric(target_df.iloc[[base_power_row], base_power_col]).iloc[0]) / 10
+                plant_out['基础电量/优先发电量（万千瓦时）'] = round(base_power, 2)
+                log.append(f"📊 基础电量：{base_power:.2f}万千瓦时")
+            except:
+                messages.append(("warning", "⚠️ 基础电量提取失败"))
+        
+        # 考核金额
+        assessment_row = 168
+        if len(target_df) > assessment_row and len(target_df.columns) > amount_col_index:
+            try:
+                assess_amt = float(amount_values[assessment_row]) / 10000
+                plant_out['考核金额'] = round(assess_amt, 2)
+                plant_out['是否有偏差考核'] = '是' if assess_amt != 0 else '否'
+                log.append(f"📊 考核金额：{assess_amt:.2f}万元，偏差考核：{plant_out['是否有偏差考核']}")
+            except:
+                plant_out['是否有偏差考核'] = '否'
+                messages.append(("warning", "⚠️ 考核金额提取失败"))
+        else:
+            plant_out['是否有偏差考核'] = '否'
+            messages.append(("warning", "⚠️ 考核金额行/列不存在"))
+        
+        # 结算电费
+        if len(target_df) > 0 and len(target_df.columns) > amount_col_index:
+            try:
+                settle_fee = float(amount_values[0]) / 10000
+                plant_out['结算电费（万元）'] = round(settle_fee, 2)
+                log.append(f"📊 结算电费：{settle_fee:.2f}万元")
+            except:
+                messages.append(("warning", "⚠️ 结算电费提取失败"))
+        
+        # 衍生计算（未提取到的字段沿用模板原值）
+        online_power = plant_out.get('上网电量（万千瓦时）', template_row['上网电量（万千瓦时）'])
+        base_power = plant_out.get('基础电量/优先发电量（万千瓦时）', template_row['基础电量/优先发电量（万千瓦时）'])
+        if isinstance(online_power, (int, float)) and isinstance(base_power, (int, float)):
+            trade_power = online_power - base_power
+            plant_out['交易电量（万千瓦时）'] = round(trade_power, 2)
+            if online_power != 0:
+                trade_ratio = (trade_power / online_power) * 100
+                plant_out['交易电量占比（%）'] = round(trade_ratio, 2)
+            log.append(f"📊 交易电量：{trade_power:.2f}万千瓦时，占比：{plant_out.get('交易电量占比（%）', template_row['交易电量占比（%）']):.2f}%")
+        
+        settle_fee = plant_out.get('结算电费（万元）', template_row['结算电费（万元）'])
+        total_deduct = (aux_service_sum + two_rules_sum + storage_two_rules_sum) / 10000
+        if isinstance(settle_fee, (int, float)) and online_power != 0:
+            net_fee = settle_fee - total_deduct
+            plant_out['不含辅助服务与两个细则结算电费（万元）'] = round(net_fee, 2)
+            net_price = (net_fee * 10000) / (online_power * 10000)
+            plant_out['不含辅助服务与两个细则结算平均电价(元/千瓦时)'] = round(net_price, 4)
+            log.append(f"📊 净结算电费：{net_fee:.2f}万元，平均电价：{net_price:.4f}元/千瓦时")
+    except Exception as e:
+        return plant_out, log, messages, str(e)
+    return plant_out, log, messages, None
+
+def apply_plant_results(df, results):
+    """将各电厂缓存的提取结果按列一次性写回主表格（未提取的单元格保留原值）"""
+    if not results:
+        return
+    update_df = pd.DataFrame.from_dict(results, orient='index').reindex(df.index)
+    for col in update_df.columns:
+        merged = update_df[col].where(update_df[col].notna(), df[col])
+        # 文本列写回后保持字符串类型
+        if isinstance(df[col].dtype, pd.StringDtype):
+            merged = merged.astype(df[col].dtype)
+        df[col] = merged
+
+def write_excel_streaming(df, output, sheet_name='Sheet1'):
+    """openpyxl只写模式逐行写出DataFrame，不在内存中构建完整单元格网格"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append(list(df.columns))
+    # 空值写为空单元格（与 to_excel 一致）
+    for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+        ws.append(row)
+    wb.save(output)
 
 # -------------------------- Streamlit 界面配置 --------------------------
 st.set_page_config(
@@ -170,7 +460,7 @@ if st.button("🚀 开始处理", type="primary"):
             # 初始化主数据框
             if template_file:
                 try:
-                    df = pd.read_excel(template_file, sheet_name='Sheet1', engine='openpyxl')
+                    df = read_excel_fast(template_file, sheet_name='Sheet1')
                     st.success(f"✅ 成功读取模板文件（{len(df)}行数据）")
                 except Exception as e:
                     st.warning(f"⚠️ 读取模板文件失败：{str(e)}，创建新表格")
@@ -179,10 +469,16 @@ if st.button("🚀 开始处理", type="primary"):
                 st.info("ℹ️ 未提供模板文件，创建新表格")
                 df = pd.DataFrame()
             
-            # 补全所有列
+            # 补全所有列：缺失列一次性按类型创建，文本列统一为字符串类型
+            missing_cols = {}
             for col in required_columns:
                 if col not in df.columns:
-                    df[col] = 0.0 if any(key in col for key in ['（元）', '（万元）', '（%）', '万千瓦时', '万kwh']) else ""
+                    if any(key in col for key in NUMERIC_COL_KEYS):
+                        missing_cols[col] = pd.Series(0.0, index=df.index, dtype='float64')
+                    else:
+                        missing_cols[col] = pd.Series("", index=df.index, dtype=object)
+            df = df.assign(**missing_cols)
+            df[TEXT_COLUMNS] = df[TEXT_COLUMNS].astype(TEXT_DTYPE)
             
             # 设置月份
             df['月份'] = month
@@ -191,7 +487,7 @@ if st.button("🚀 开始处理", type="primary"):
         # 存储上传的文件信息（文件名→文件对象）
         settlement_file_dict = {}
         for file in settlement_files:
-            # 提取文件名（不含后缀）用于匹配电厂名称
+            # 以文件名（不含后缀）为键，按「电厂名+日期」直接查找；重名时保留最后上传的文件
             file_name = os.path.splitext(file.name)[0]
             settlement_file_dict[file_name] = file
         st.success(f"✅ 已加载 {len(settlement_file_dict)} 个结算文件")
@@ -205,236 +501,87 @@ if st.button("🚀 开始处理", type="primary"):
         result_container = st.container()
         
         total_plants = len(df) if not df.empty else len(plant_name_mapping)
-        processed_count = 0
+        progress_step = max(1, total_plants // 50)
+        results = {}
+        # 各电厂对应的结算文件名（电厂名+日期）在循环前一次性生成
+        plant_target_files = {plant: f'{base_name}{date_str}' for plant, base_name in plant_name_mapping.items()}
         
+        # 先在主线程为每行匹配结算文件，确定需要提取的任务
+        plan = []
+        tasks = {}
         for index, row in df.iterrows():
             plant_name = row['电厂名称']
             if pd.isna(plant_name) or str(plant_name).strip() == "":
-                with result_container:
-                    st.warning(f"⚠️ 行{index+1}：电厂名称为空，跳过处理")
-                processed_count += 1
-                progress_bar.progress(processed_count / total_plants)
+                plan.append((index, plant_name, "empty", None))
+                continue
+            if plant_name not in plant_target_files:
+                plan.append((index, plant_name, "unmapped", None))
                 continue
+            target_file_name = plant_target_files[plant_name]
             
-            status_text.text(f"🔧 正在处理：{plant_name}（行{index+1}）")
+            # 查找匹配的文件：文件名恰为「电厂名+日期」时直接命中，否则回退包含匹配
+            matched_file = settlement_file_dict.get(target_file_name)
+            if matched_file is None:
+                for file_name, file_obj in settlement_file_dict.items():
+                    if target_file_name in file_name:
+                        matched_file = file_obj
+                        break
             
-            with result_container:
-                st.markdown(f"### 🔍 处理电厂：{plant_name}")
-                
-                if plant_name in plant_name_mapping:
-                    base_name = plant_name_mapping[plant_name]
-                    target_file_name = f'{base_name}{date_str}'
-                    
-                    # 查找匹配的文件
-                    matched_file = None
-                    for file_name, file_obj in settlement_file_dict.items():
-                        if target_file_name in file_name:
-                            matched_file = file_obj
-                            break
-                    
-                    if not matched_file:
-                        st.error(f"❌ 未找到对应的结算文件：{target_file_name}.xlsx")
-                        processed_count += 1
+            if not matched_file:
+                plan.append((index, plant_name, "missing", target_file_name))
+                continue
+            plan.append((index, plant_name, "task", None))
+            tasks[index] = (matched_file.getvalue(), matched_file.name, row)
+        
+        # 无需提取的行直接计入进度
+        processed_count = len(plan) - len(tasks)
+        progress_bar.progress(processed_count / total_plants)
+        
+        # 各电厂结算文件相互独立，用线程池并行读取与提取（Streamlit调用只在主线程）
+        outcomes = {}
+        if tasks:
+            with ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, len(tasks))) as executor:
+                futures = {executor.submit(extract_plant, *task): index for index, task in tasks.items()}
+                for future in as_completed(futures):
+                    index = futures[future]
+                    outcomes[index] = future.result()
+                    results[index] = outcomes[index][0]
+                    processed_count += 1
+                    # 进度条约每2%刷新一次，减少前端消息量
+                    if processed_count % progress_step == 0 or processed_count == total_plants:
+                        status_text.text(f"🔧 已完成：{df.at[index, '电厂名称']}（行{index+1}）")
                         progress_bar.progress(processed_count / total_plants)
-                        continue
-                    
-                    try:
-                        # 读取结算文件
-                        try:
-                            target_df = pd.read_excel(matched_file, sheet_name='sheet1', header=4, engine='openpyxl')
-                        except:
-                            target_df = pd.read_excel(matched_file, sheet_name='sheet1', header=4, engine='xlrd')
-                        
-                        st.success(f"✅ 成功读取结算文件：{matched_file.name}（数据形状：{target_df.shape}）")
-                        
-                        # 初始化提取变量
-                        aux_service_sum = 0.0
-                        two_rules_sum = 0.0
-                        storage_two_rules_sum = 0.0
-                        profit_recovery = 0.0
-                        new_target_results = {
-                            "省内现货偏差电量（万千瓦时）": 0.0,
-                            "省内现货电费（万元）": 0.0,
-                            "省间现货电量（万千瓦时）": 0.0,
-                            "省间现货电费（万元）": 0.0,
-                            "中长期电费（万元）": 0.0,
-                            "保障性电费（万元）": 0.0
-                        }
-                        mechanism_power_sum = 0.0
-                        mechanism_fee_sum = 0.0
-                        
-                        # 遍历结算文件行
-                        for row_idx in range(len(target_df)):
-                            row_data = target_df.iloc[row_idx]
-                            row_str = str(row_data).strip()
-                            
-                            # 1. 辅助服务提取
-                            if any(aux_sub in row_str for aux_sub in TARGET_AUX_SERVICES):
-                                if len(target_df.columns) > amount_col_index:
-                                    amount_val = target_df.iloc[row_idx, amount_col_index]
-                                    amount = clean_data(amount_val)
-                                    aux_service_sum += amount
-                                    matched_aux = [sub for sub in TARGET_AUX_SERVICES if sub in row_str][0]
-                                    st.write(f"  ✅ 辅助服务：{matched_aux} → {amount:.2f}元")
-                            
-                            # 2. 普通两个细则提取
-                            if any(two_sub in row_str for two_sub in TARGET_TWO_RULES):
-                                if len(target_df.columns) > amount_col_index:
-                                    amount_val = target_df.iloc[row_idx, amount_col_index]
-                                    amount = clean_data(amount_val)
-                                    two_rules_sum += amount
-                                    matched_two = [sub for sub in TARGET_TWO_RULES if sub in row_str][0]
-                                    st.write(f"  ✅ 普通两个细则：{matched_two} → {amount:.2f}元")
-                            
-                            # 3. 配储两个细则提取
-                            if any(storage_sub in row_str for storage_sub in TARGET_STORAGE_TWO_RULES):
-                                if len(target_df.columns) > amount_col_index:
-                                    amount_val = target_df.iloc[row_idx, amount_col_index]
-                                    amount = clean_data(amount_val)
-                                    storage_two_rules_sum += amount
-                                    matched_storage = [sub for sub in TARGET_STORAGE_TWO_RULES if sub in row_str][0]
-                                    st.write(f"  ✅ 配储两个细则：{matched_storage} → {amount:.2f}元")
-                            
-                            # 4. 超额获利回收提取
-                            if TARGET_PROFIT_RECOVERY in row_str:
-                                if len(target_df.columns) > amount_col_index:
-                                    amount_val = target_df.iloc[row_idx, amount_col_index]
-                                    profit_recovery = clean_data(amount_val)
-                                    st.write(f"  ✅ 超额获利回收：{TARGET_PROFIT_RECOVERY} → {profit_recovery:.2f}元")
-                            
-                            # 5. 新增科目提取
-                            for target_subject, mapping in NEW_TARGETS.items():
-                                if target_subject in row_str:
-                                    st.write(f"  🔍 匹配新增科目：{target_subject}")
-                                    # 提取电费
-                                    if len(target_df.columns) > amount_col_index:
-                                        fee_val = target_df.iloc[row_idx, amount_col_index]
-                                        fee = clean_data(fee_val) / 10000
-                                        new_target_results[mapping["fee_field"]] = round(fee, 2)
-                                        st.write(f"    ✅ 电费：{fee:.2f}万元")
-                                    # 提取电量
-                                    if mapping["power_field"] and mapping["power_col_index"] is not None:
-                                        power_col = mapping["power_col_index"]
-                                        if len(target_df.columns) > power_col:
-                                            power_val = target_df.iloc[row_idx, power_col]
-                                            power = clean_data(power_val) / 10
-                                            new_target_results[mapping["power_field"]] = round(power, 2)
-                                            st.write(f"    ✅ 电量：{power:.2f}万千瓦时")
-                            
-                            # 6. 机制电量相关提取
-                            if any(mech_sub in row_str for mech_sub in TARGET_MECHANISM):
-                                matched_mech = [sub for sub in TARGET_MECHANISM if sub in row_str][0]
-                                st.write(f"  🔍 匹配机制科目：{matched_mech}")
-                                # 提取电量
-                                if len(target_df.columns) > MECHANISM_POWER_COL_INDEX:
-                                    power_val = target_df.iloc[row_idx, MECHANISM_POWER_COL_INDEX]
-                                    power = clean_data(power_val) / 10
-                                    mechanism_power_sum += power
-                                    st.write(f"    ✅ 机制电量：{power:.2f}万kwh")
-                                # 提取电费
-                                if len(target_df.columns) > amount_col_index:
-                                    fee_val = target_df.iloc[row_idx, amount_col_index]
-                                    fee = clean_data(fee_val)
-                                    mechanism_fee_sum += fee
-                                    st.write(f"    ✅ 机制电费：{fee:.2f}元")
-                        
-                        # 赋值到主表格
-                        df.at[index, '辅助服务（元）'] = round(aux_service_sum, 2)
-                        df.at[index, '辅助服务电费(万元)'] = round(aux_service_sum / 10000, 4)
-                        df.at[index, '两个细则（元）'] = round(two_rules_sum, 2)
-                        df.at[index, '两个细则电费（万元）'] = round(two_rules_sum / 10000, 4)
-                        df.at[index, '配储两个细则（元）'] = round(storage_two_rules_sum, 2)
-                        df.at[index, '配储两个细则电费（万元）'] = round(storage_two_rules_sum / 10000, 4)
-                        df.at[index, '中长期超额获利回收电费（元）'] = round(profit_recovery, 2)
-                        
-                        # 新增字段赋值
-                        for field, value in new_target_results.items():
-                            df.at[index, field] = value
-                        
-                        # 机制字段赋值
-                        df.at[index, '机制电量（万kwh）'] = round(mechanism_power_sum, 2)
-                        df.at[index, '机制电费（元）'] = round(mechanism_fee_sum, 2)
-                        
-                        # 其他指标提取
-                        # 上网电量
-                        if '实际上网电量' in target_df.columns and len(target_df) > 0:
-                            try:
-                                actual_power = clean_data(target_df['实际上网电量'].iloc[0]) / 10
-                                df.at[index, '上网电量（万千瓦时）'] = round(actual_power, 2)
-                                st.write(f"📊 上网电量：{actual_power:.2f}万千瓦时")
-                            except:
-                                st.warning("⚠️ 上网电量提取失败")
-                        
-                        # 基础电量
-                        base_power_row = 11
-                        base_power_col = 3
-                        if len(target_df) > base_power_row and len(target_df.columns) > base_power_col:
-                            try:
-                                base_power_val = target_df.iloc[base_power_row, base_power_col]
-                                base_power = clean_data(base_power_val) / 10
-                                df.at[index, '基础电量/优先发电量（万千瓦时）'] = round(base_power, 2)
-                                st.write(f"📊 基础电量：{base_power:.2f}万千瓦时")
-                            except:
-                                st.warning("⚠️ 基础电量提取失败")
-                        
-                        # 考核金额
-                        assessment_row = 168
-                        if len(target_df) > assessment_row and len(target_df.columns) > amount_col_index:
-                            try:
-                                assess_amt_val = target_df.iloc[assessment_row, amount_col_index]
-                                assess_amt = clean_data(assess_amt_val) / 10000
-                                df.at[index, '考核金额'] = round(assess_amt, 2)
-                                df.at[index, '是否有偏差考核'] = '是' if assess_amt != 0 else '否'
-                                st.write(f"📊 考核金额：{assess_amt:.2f}万元，偏差考核：{df.at[index, '是否有偏差考核']}")
-                            except:
-                                df.at[index, '是否有偏差考核'] = '否'
-                                st.warning("⚠️ 考核金额提取失败")
-                        else:
-                            df.at[index, '是否有偏差考核'] = '否'
-                            st.warning("⚠️ 考核金额行/列不存在")
-                        
-                        # 结算电费
-                        if len(target_df) > 0 and len(target_df.columns) > amount_col_index:
-                            try:
-                                settle_fee_val = target_df.iloc[0, amount_col_index]
-                                settle_fee = clean_data(settle_fee_val) / 10000
-                                df.at[index, '结算电费（万元）'] = round(settle_fee, 2)
-                                st.write(f"📊 结算电费：{settle_fee:.2f}万元")
-                            except:
-                                st.warning("⚠️ 结算电费提取失败")
-                        
-                        # 衍生计算
-                        online_power = df.at[index, '上网电量（万千瓦时）']
-                        base_power = df.at[index, '基础电量/优先发电量（万千瓦时）']
-                        if isinstance(online_power, (int, float)) and isinstance(base_power, (int, float)):
-                            trade_power = online_power - base_power
-                            df.at[index, '交易电量（万千瓦时）'] = round(trade_power, 2)
-                            if online_power != 0:
-                                trade_ratio = (trade_power / online_power) * 100
-                                df.at[index, '交易电量占比（%）'] = round(trade_ratio, 2)
-                            st.write(f"📊 交易电量：{trade_power:.2f}万千瓦时，占比：{df.at[index, '交易电量占比（%）']:.2f}%")
-                        
-                        settle_fee = df.at[index, '结算电费（万元）']
-                        total_deduct = (aux_service_sum + two_rules_sum + storage_two_rules_sum) / 10000
-                        if isinstance(settle_fee, (int, float)) and online_power != 0:
-                            net_fee = settle_fee - total_deduct
-                            df.at[index, '不含辅助服务与两个细则结算电费（万元）'] = round(net_fee, 2)
-                            net_price = (net_fee * 10000) / (online_power * 10000)
-                            df.at[index, '不含辅助服务与两个细则结算平均电价(元/千瓦时)'] = round(net_price, 4)
-                            st.write(f"📊 净结算电费：{net_fee:.2f}万元，平均电价：{net_price:.4f}元/千瓦时")
-                        
-                        st.success(f"✅ {plant_name} 处理完成！")
-                        st.markdown("---")
-                        
-                    except Exception as e:
-                        st.error(f"❌ 处理失败：{str(e)}")
-                        st.markdown("---")
-                else:
+        
+        # 按表格顺序输出各电厂处理结果
+        with result_container:
+            for index, plant_name, status, target_file_name in plan:
+                if status == "empty":
+                    st.warning(f"⚠️ 行{index+1}：电厂名称为空，跳过处理")
+                    continue
+                
+                st.markdown(f"### 🔍 处理电厂：{plant_name}")
+                if status == "unmapped":
                     st.error(f"❌ 电厂名称 {plant_name} 未在映射表中")
                     st.markdown("---")
-            
-            processed_count += 1
-            progress_bar.progress(processed_count / total_plants)
+                    continue
+                if status == "missing":
+                    st.error(f"❌ 未找到对应的结算文件：{target_file_name}.xlsx")
+                    continue
+                
+                _, log, messages, error = outcomes[index]
+                for level, message in messages:
+                    getattr(st, level)(message)
+                if log:
+                    with st.expander(f"{plant_name} 明细"):
+                        st.code('\n'.join(log))
+                if error is None:
+                    st.success(f"✅ {plant_name} 处理完成！")
+                else:
+                    st.error(f"❌ 处理失败：{error}")
+                st.markdown("---")
+        
+        # 各电厂结果一次性写回主表格
+        apply_plant_results(df, results)
         
         # 处理完成
         status_text.text("✅ 所有电厂处理完成！")
@@ -449,8 +596,7 @@ if st.button("🚀 开始处理", type="primary"):
         
         # 保存到BytesIO
         output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Sheet1', index=False)
+        write_excel_streaming(df, output, sheet_name='Sheet1')
         
         output.seek(0)
         
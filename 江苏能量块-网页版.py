@@ -1,18 +1,47 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill
 from io import BytesIO
 
+# numba 为可选依赖：已安装时差额计算内核JIT编译并缓存到磁盘，未安装时直接按NumPy执行
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+# calamine 引擎需要 pandas >= 2.2 且已安装 python-calamine，不满足时改用其他引擎（其余读取错误照常抛出）
+try:
+    import python_calamine  # noqa: F401
+    CALAMINE_AVAILABLE = tuple(int(part) for part in pd.__version__.split('.')[:2]) >= (2, 2)
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
 # -------------------------- 全局配置 --------------------------
 ROUND_DECIMALS = 1  # 统一保留1位小数
 FEB1_SHEET_NAME = "2.1"  # 功率文件中2月1日的sheet名
 
 # -------------------------- 核心计算函数 --------------------------
+def read_excel_fast(uploaded_file, **kwargs):
+    """calamine引擎可用时用其读取Excel，否则改用openpyxl"""
+    if CALAMINE_AVAILABLE:
+        return pd.read_excel(uploaded_file, engine='calamine', **kwargs)
+    return pd.read_excel(uploaded_file, engine='openpyxl', **kwargs)
+
+def open_excel_file(uploaded_file, fallback_engine='xlrd'):
+    """calamine引擎可用时用其打开工作簿，否则改用指定引擎"""
+    if CALAMINE_AVAILABLE:
+        return pd.ExcelFile(uploaded_file, engine='calamine')
+    return pd.ExcelFile(uploaded_file, engine=fallback_engine)
+
 def get_position_data(uploaded_file):
     """读取持仓数据（统一24时段：0-23点）"""
     try:
-        # 兼容 pandas 1.5.3 + openpyxl 3.0.9 的读取方式
-        pos_df = pd.read_excel(uploaded_file, engine='openpyxl', header=0)
+        # calamine 不可用时（pandas < 2.2）回退 openpyxl 3.0.9
+        pos_df = read_excel_fast(uploaded_file, header=0)
         if pos_df.shape[1] < 5:
             st.error("持仓文件列数不足，需至少5列（E列存储持仓数据）")
             return None
@@ -26,66 +55,69 @@ def get_position_data(uploaded_file):
         st.error(f"持仓文件读取失败：{str(e)}")
         return None
 
-def get_valid_power_data(uploaded_file, sheet_name):
-    """读取功率数据，统一映射到0-23时段（4-20点有效，其余补0）"""
+def get_valid_power_data(power_xls, sheet_name):
+    """从已打开的功率工作簿读取指定sheet，统一映射到0-23时段（4-20点有效，其余补0）"""
     try:
-        df = pd.read_excel(
-            uploaded_file,
-            sheet_name=sheet_name,
-            engine='xlrd',
+        df = power_xls.parse(
+            sheet_name,
             usecols=[1],
             skiprows=1,
             header=None
         )
-        df.columns = ["原始功率(kW)"]
-        df["原始功率(kW)"] = pd.to_numeric(df["原始功率(kW)"], errors='coerce').fillna(0)
-
-        if len(df) < 96:
-            pad = pd.DataFrame({"原始功率(kW)": [0.0] * (96 - len(df))})
-            df = pd.concat([df, pad], ignore_index=True)
-        df = df.head(96)
+        raw_power = pd.to_numeric(df.iloc[:, 0], errors='coerce').fillna(0).to_numpy(dtype=float)
+        # 15分钟点位不足96个补0，超出截断，再按每4个点求小时均值
+        raw_power = np.concatenate([raw_power, np.zeros(max(0, 96 - len(raw_power)))])[:96]
+        hourly_power = raw_power.reshape(24, 4).mean(axis=1)
 
-        period_power = [0.0] * 24
+        period_power = np.zeros(24)
         valid_start_period = 4
         valid_period_count = 17
-
-        for i in range(valid_period_count):
-            if valid_start_period + i < 24:
-                power_avg = df["原始功率(kW)"].iloc[i*4 : (i+1)*4].mean()
-                period_power[valid_start_period + i] = round(power_avg, ROUND_DECIMALS)
-        return period_power
+        period_power[valid_start_period:valid_start_period + valid_period_count] = np.round(
+            hourly_power[:valid_period_count], ROUND_DECIMALS
+        )
+        return period_power.tolist()
     except Exception as e:
         st.warning(f"功率sheet【{sheet_name}】处理失败，使用全0数据：{str(e)}")
         return [0.0] * 24
 
+@njit(cache=True)
+def balance_kernel(daily, positions, feb1):
+    """差额计算内核（数组输入），返回 (0.1倍发电量, 最终差额)"""
+    daily_01 = np.round(daily * 0.1, ROUND_DECIMALS)
+    daily_balance = np.round(daily_01 - positions, ROUND_DECIMALS)
+
+    feb1_01 = np.round(feb1 * 0.1, ROUND_DECIMALS)
+    feb1_balance = np.round(feb1_01 - positions, ROUND_DECIMALS)
+
+    final_balance = np.round(daily_balance - feb1_balance, ROUND_DECIMALS)
+    return daily_01, final_balance
+
 def calc_unified_balance(daily_power, positions, feb1_power):
     """计算差额（统一保留1位小数）"""
-    daily_01 = [round(p * 0.1, ROUND_DECIMALS) for p in daily_power]
-    daily_balance = [round(d01 - pos, ROUND_DECIMALS) for d01, pos in zip(daily_01, positions)]
+    daily = np.asarray(daily_power, dtype=float)
+    pos = np.asarray(positions, dtype=float)
+    feb1 = np.asarray(feb1_power, dtype=float)
 
-    feb1_01 = [round(p * 0.1, ROUND_DECIMALS) for p in feb1_power]
-    feb1_balance = [round(f01 - pos, ROUND_DECIMALS) for f01, pos in zip(feb1_01, positions)]
-
-    final_balance = [round(d_bal - f_bal, ROUND_DECIMALS) for d_bal, f_bal in zip(daily_balance, feb1_balance)]
-    return daily_power, daily_01, final_balance
+    daily_01, final_balance = balance_kernel(daily, pos, feb1)
+    return daily.tolist(), daily_01.tolist(), final_balance.tolist()
 
 def generate_excel_with_highlight(df):
-    """生成带负差额标黄的Excel文件（兼容 openpyxl 3.0.9）"""
+    """生成带负差额标黄的Excel文件（只写模式单次写出，写行时直接标黄）"""
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name="统一24时段汇总", index=False)
-
-    wb = writer.book
-    ws = wb["统一24时段汇总"]
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("统一24时段汇总")
     yellow_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
-
-    for col_idx in range(1, ws.max_column + 1):
-        col_name = ws.cell(row=1, column=col_idx).value
-        if col_name and "差额" in str(col_name):
-            for row_idx in range(2, ws.max_row + 1):
-                val = ws.cell(row_idx, col_idx).value
-                if isinstance(val, (int, float)) and val < 0:
-                    ws.cell(row_idx, col_idx).fill = yellow_fill
+    balance_cols = {col_idx for col_idx, col_name in enumerate(df.columns) if "差额" in str(col_name)}
+
+    ws.append(list(df.columns))
+    for row in df.itertuples(index=False, name=None):
+        cells = []
+        for col_idx, val in enumerate(row):
+            cell = WriteOnlyCell(ws, value=val)
+            if col_idx in balance_cols and isinstance(val, (int, float)) and val < 0:
+                cell.fill = yellow_fill
+            cells.append(cell)
+        ws.append(cells)
 
     wb.save(output)
     output.seek(0)
@@ -128,29 +160,29 @@ if calc_button:
 
             # 读取功率文件
             try:
-                power_xls = pd.ExcelFile(power_file, engine='xlrd')
+                power_xls = open_excel_file(power_file)
                 all_dates = power_xls.sheet_names
                 st.success(f"✅ 检测到功率文件共 {len(all_dates)} 个日期：{all_dates}")
             except Exception as e:
                 st.error(f"功率文件读取失败：{str(e)}")
                 st.stop()
 
-            # 计算基准数据
-            feb1_power = get_valid_power_data(power_file, FEB1_SHEET_NAME)
-
             # 初始化结果
             summary_data = {
                 "统一时段（点）": list(range(24)),
                 "持仓值(kWh)": positions
             }
 
-            # 遍历计算
-            for date in all_dates:
-                daily_power = get_valid_power_data(power_file, date)
-                daily_power, daily_01, final_balance = calc_unified_balance(daily_power, positions, feb1_power)
-                summary_data[f"{date}_发电量(kWh)"] = daily_power
-                summary_data[f"{date}_0.1倍发电量(kWh)"] = daily_01
-                summary_data[f"{date}_差额(kWh)"] = final_balance
+            # 工作簿只解析一次，基准数据与各日期sheet均复用
+            with power_xls:
+                feb1_power = get_valid_power_data(power_xls, FEB1_SHEET_NAME)
+
+                for date in all_dates:
+                    daily_power = get_valid_power_data(power_xls, date)
+                    daily_power, daily_01, final_balance = calc_unified_balance(daily_power, positions, feb1_power)
+                    summary_data[f"{date}_发电量(kWh)"] = daily_power
+                    summary_data[f"{date}_0.1倍发电量(kWh)"] = daily_01
+                    summary_data[f"{date}_差额(kWh)"] = final_balance
 
             # 展示结果
             result_df = pd.DataFrame(summary_data)